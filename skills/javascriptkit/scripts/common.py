@@ -0,0 +1,69 @@
+# Helpers shared by doctor.py and install-sdk.py
+
+import json
+import os
+import tempfile
+
+def get_cache_dir():
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache")
+    return os.path.join(base, "swift-wasm-skill")
+
+def write_cache_file(path, data):
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except OSError:
+        pass
+
+def get_target_info_key(swiftc_path):
+    if not swiftc_path:
+        return None
+    real_path = os.path.realpath(swiftc_path)
+    # Only cache for a swiftc that lives in a toolchain's bin directory. Shims
+    # (xcrun's /usr/bin/swiftc, swiftly, asdf, mise) pick the toolchain at run
+    # time from the environment, so their path and mtime don't identify the compiler.
+    if not os.path.exists(os.path.join(os.path.dirname(real_path), "swift-frontend")):
+        return None
+    try:
+        return [real_path, os.path.getmtime(real_path)]
+    except OSError:
+        return None
+
+def load_cached_target_info(key):
+    if not key:
+        return None
+    try:
+        with open(os.path.join(get_cache_dir(), "target-info.json")) as f:
+            cached = json.load(f)
+        if cached.get("key") == key:
+            return cached["info"]
+    except Exception:
+        pass
+    return None
+
+def store_target_info(key, info):
+    if key:
+        data = json.dumps({"key": key, "info": info}).encode("utf-8")
+        write_cache_file(os.path.join(get_cache_dir(), "target-info.json"), data)
+
+def get_installed_sdk_bundles():
+    # 'swift sdk list' just enumerates the bundles in SwiftPM's swift-sdks directory.
+    # Names are listed as bytes so they are matched without decoding each one.
+    entries = []
+    for sdks_dir in ["~/.swiftpm/swift-sdks", "~/Library/org.swift.swiftpm/swift-sdks"]:
+        try:
+            entries.extend(os.listdir(os.fsencode(os.path.expanduser(sdks_dir))))
+        except OSError:
+            pass
+    return entries
+
+def find_matching_sdk_bundle(entries, version_id):
+    # The bundle for a toolchain is named after its exact tag, e.g.
+    # 'swift-6.2.3-RELEASE_wasm.artifactbundle'; a bare substring test would let
+    # swift-6.2-RELEASE match the 6.2.3 bundle.
+    tag = f"swift-{version_id}-RELEASE" if version_id.replace(".", "").isdigit() else version_id
+    prefix = os.fsencode(f"{tag}_wasm")
+    return next((name for name in entries if name.startswith(prefix)), None)
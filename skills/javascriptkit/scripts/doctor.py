@@ -1,12 +1,23 @@
 #!/usr/bin/env python3
 
+import functools
 import json
+import os
 import subprocess
 import sys
 import shutil
+from concurrent.futures import ThreadPoolExecutor
 
-def check_cmd(cmd, name):
-    path = shutil.which(cmd)
+from common import find_matching_sdk_bundle, get_installed_sdk_bundles, get_target_info_key, load_cached_target_info, store_target_info
+
+@functools.lru_cache(maxsize=None)
+def which(cmd):
+    # swiftc is looked up both for the check and for the target-info cache key
+    return shutil.which(cmd)
+
+def check_cmd(cmd, name, path=None):
+    if path is None:
+        path = which(cmd)
     if path:
         print(f"[OK] {name} found")
         return True
@@ -15,11 +26,18 @@ def check_cmd(cmd, name):
         return False
 
 def get_target_info():
+    key = get_target_info_key(which("swiftc"))
+    info = load_cached_target_info(key)
+    if info:
+        return info
+
     try:
-        output = subprocess.check_output(["swiftc", "-print-target-info"], stderr=subprocess.DEVNULL).decode("utf-8")
-        return json.loads(output)
+        output = subprocess.run(["swiftc", "-print-target-info"], text=True, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, check=True).stdout
+        info = json.loads(output)
     except Exception:
         return None
+    store_target_info(key, info)
+    return info
 
 def main():
     print("Checking environment for Swift WebAssembly development...")
@@ -30,8 +48,16 @@ def main():
         print("   Please install Swift from https://www.swift.org/install/ or via 'swiftly'.")
         sys.exit(1)
 
+    # The remaining probes are independent, so run them concurrently and
+    # report the results in order below.
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        info_future = executor.submit(get_target_info)
+        node_future = executor.submit(which, "node")
+        npm_future = executor.submit(which, "npm")
+        sdk_entries_future = executor.submit(get_installed_sdk_bundles)
+
     # 2. Verify OSS Toolchain
-    info = get_target_info()
+    info = info_future.result()
     if not info:
         print("[ERROR] Failed to get Swift target info.")
         sys.exit(1)
@@ -48,34 +74,29 @@ def main():
         print("[WARNING] Could not determine Swift compiler tag. Assuming OSS toolchain.")
 
     # 3. Verify Node.js and npm
-    check_cmd("node", "Node.js")
-    check_cmd("npm", "npm")
+    check_cmd("node", "Node.js", node_future.result())
+    check_cmd("npm", "npm", npm_future.result())
 
     # 4. Verify Swift SDK for WebAssembly
-    try:
-        sdk_list = subprocess.check_output(["swift", "sdk", "list"], stderr=subprocess.DEVNULL).decode("utf-8")
-    except Exception:
-        sdk_list = ""
-
-    # Extract the core part of the tag for matching (e.g., 6.2.3 or DEVELOPMENT-SNAPSHOT-...)
-    # This matches the logic in install-sdk.py
-    tag_core = compiler_tag.replace("swift-", "").replace("-RELEASE", "")
+    sdk_entries = sdk_entries_future.result()
 
-    if not tag_core:
+    if not compiler_tag:
         # Fallback to general wasm check
-        if "wasm" in sdk_list.lower():
+        if any(b"wasm" in name.lower() for name in sdk_entries):
             print("[OK] Swift SDK for WebAssembly detected (general check)")
         else:
             print("[ERROR] Swift SDK for WebAssembly not found.")
             print("   Please run './scripts/install-sdk.py' to install it.")
             sys.exit(1)
     else:
-        # Precise check: does the SDK list contain the current toolchain's tag?
-        if tag_core in sdk_list:
-            print(f"[OK] Matching Swift SDK for WebAssembly found ({tag_core})")
+        # Precise check: is the bundle for the current toolchain's tag installed?
+        # install-sdk.py uses the same check to decide whether to install.
+        bundle = find_matching_sdk_bundle(sdk_entries, compiler_tag)
+        if bundle:
+            print(f"[OK] Matching Swift SDK for WebAssembly found ({os.fsdecode(bundle)})")
         else:
             print(f"[ERROR] No matching Swift SDK for WebAssembly found for toolchain {compiler_tag}.")
-            print("   Please run './scripts/install-sdk.py' to automatically install the matching SDK.")
+            print(f"   Please run './scripts/install-sdk.py --version-id {compiler_tag}' to automatically install the matching SDK.")
             sys.exit(1)
 
     print("")
@@ -1,74 +1,209 @@
 #!/usr/bin/env python3
 
+import argparse
+import hashlib
+import http.client
 import json
+import os
 import re
+import shutil
 import subprocess
 import sys
+import time
+import urllib.error
 import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+from common import find_matching_sdk_bundle, get_cache_dir, get_installed_sdk_bundles, get_target_info_key, load_cached_target_info, write_cache_file
+
+_DEV_BRANCH_RE = re.compile(r"swift-([0-9.]+)-DEVELOPMENT")
+_VERSION_PREFIX_RE = re.compile(r"swift-([0-9.]+)")
+_JSON_WS_RE = re.compile(r"[ \t\n\r]*")
+
+# swift.org API responses change at most a few times a day
+_API_CACHE_TTL = 3600
+_use_api_cache = True
+
+_DOWNLOAD_CHUNK_SIZE = 1024 * 1024
 
 def get_swift_version():
+    info = load_cached_target_info(get_target_info_key(shutil.which("swiftc")))
+    if info and "swiftCompilerTag" in info:
+        return info["swiftCompilerTag"]
+
     try:
         # Try -print-target-info first, as it provides the most accurate tag for snapshots
-        target_info = subprocess.check_output(["swiftc", "-print-target-info"]).decode("utf-8")
-        info = json.loads(target_info)
-        if "swiftCompilerTag" in info:
-            return info["swiftCompilerTag"]
+        target_info = subprocess.run(["swiftc", "-print-target-info"], text=True, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, check=True).stdout
+        # Only the tag is needed, so pull it out without parsing the whole document
+        idx = target_info.find('"swiftCompilerTag"')
+        if idx != -1:
+            q1 = target_info.find('"', idx + len('"swiftCompilerTag"'))
+            q2 = target_info.find('"', q1 + 1)
+            if q1 != -1 and q2 != -1:
+                return target_info[q1 + 1:q2]
     except Exception:
         pass
 
     try:
-        output = subprocess.check_output(["swiftc", "--version"]).decode("utf-8")
+        output = subprocess.run(["swiftc", "--version"], text=True, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, check=True).stdout
         # Example: Swift version 6.0.3 (swift-6.0.3-RELEASE)
         # Example: Swift version 6.1-dev (swift-6.1-DEVELOPMENT-SNAPSHOT-2024-10-23-a)
-        match = re.search(r"\((swift-[^)]+)\)", output)
-        if match:
-            return match.group(1)
-        
+        lp = output.find("(swift-")
+        rp = output.find(")", lp)
+        if lp != -1 and rp != -1:
+            return output[lp + 1:rp]
+
         # Fallback for some environments
-        match = re.search(r"Swift version ([0-9.]+)", output)
-        if match:
-            return match.group(1)
-            
+        start = output.find("Swift version ")
+        if start != -1:
+            start += len("Swift version ")
+            end = start
+            while end < len(output) and output[end] in "0123456789.":
+                end += 1
+            if end > start:
+                return output[start:end]
+
         return None
     except Exception:
         return None
 
-def fetch_json(url):
+def report_error(message, errors):
+    # Callers that decide later whether an error matters pass a list to collect into
+    if errors is None:
+        print(message)
+    else:
+        errors.append(message)
+
+def get_api_cache_path(url):
+    return os.path.join(get_cache_dir(), hashlib.sha1(url.encode("utf-8")).hexdigest() + ".json")
+
+def discard_cached_response(url):
+    # A body that didn't parse (e.g. a captive portal page) must not be served for the next hour
+    try:
+        os.remove(get_api_cache_path(url))
+    except OSError:
+        pass
+
+def read_cached_response(url):
+    if not _use_api_cache:
+        return None
+    try:
+        cache_path = get_api_cache_path(url)
+        if time.time() - os.path.getmtime(cache_path) < _API_CACHE_TTL:
+            with open(cache_path, "rb") as f:
+                return f.read().decode("utf-8")
+    except (OSError, UnicodeDecodeError):
+        pass
+    return None
+
+def fetch_text(url, errors=None):
     try:
         with urllib.request.urlopen(url) as response:
-            return json.loads(response.read().decode("utf-8"))
+            data = response.read()
+        text = data.decode("utf-8")
+        write_cache_file(get_api_cache_path(url), data)
+        return text
     except Exception as e:
-        print(f"Error fetching {url}: {e}")
+        report_error(f"Error fetching {url}: {e}", errors)
         return None
 
-def find_release_sdk(version_id):
-    # version_id is like '6.2.3' or 'swift-6.2.3-RELEASE'
-    releases = fetch_json("https://www.swift.org/api/v1/install/releases.json")
-    if not releases:
+def lookup_api(url, match, errors=None):
+    # Returns match(body) for the API response at url, preferring the cached body
+    text = read_cached_response(url)
+    if text is not None:
+        try:
+            result = match(text)
+        except (ValueError, IndexError, KeyError):
+            discard_cached_response(url)
+            result = None
+        if result:
+            return result
+        # A cached body can predate a new release or snapshot; refetch once before giving up
+
+    text = fetch_text(url, errors)
+    if text is None:
         return None
+    try:
+        return match(text)
+    except (ValueError, IndexError, KeyError) as e:
+        discard_cached_response(url)
+        report_error(f"Error parsing {url}: {e}", errors)
+        return None
+
+def iter_json_array(text):
+    # Decode one element at a time so callers can stop at the first match
+    # without building objects for the rest of the array.
+    decoder = json.JSONDecoder()
+    idx = _JSON_WS_RE.match(text).end()
+    if text[idx] != "[":
+        raise ValueError(f"Expected '[' at position {idx}")
+    idx = _JSON_WS_RE.match(text, idx + 1).end()
+    if text[idx] == "]":
+        return
+    while True:
+        item, idx = decoder.raw_decode(text, idx)
+        yield item
+        idx = _JSON_WS_RE.match(text, idx).end()
+        if text[idx] == "]":
+            return
+        if text[idx] != ",":
+            raise ValueError(f"Expected ',' or ']' at position {idx}")
+        idx = _JSON_WS_RE.match(text, idx + 1).end()
 
+def match_release_sdk(releases_text, version_id):
     # Normalize version_id to '6.2.3' style for matching 'name'
     norm_version = version_id
     if version_id.startswith("swift-") and version_id.endswith("-RELEASE"):
         norm_version = version_id[6:-8]
 
-    for release in releases:
+    for release in iter_json_array(releases_text):
         if release["name"] == norm_version or release["tag"] == version_id:
-            for platform in release.get("platforms", []):
-                if platform["platform"] == "wasm-sdk":
-                    tag = release["tag"]
-                    version = release["name"]
-                    url = f"https://download.swift.org/swift-{version}-release/wasm-sdk/{tag}/{tag}_wasm.artifactbundle.tar.gz"
-                    return {
-                        "url": url,
-                        "checksum": platform["checksum"]
-                    }
+            platforms = {p["platform"]: p for p in release.get("platforms", [])}
+            wasm = platforms.get("wasm-sdk")
+            if wasm:
+                tag = release["tag"]
+                version = release["name"]
+                url = f"https://download.swift.org/swift-{version}-release/wasm-sdk/{tag}/{tag}_wasm.artifactbundle.tar.gz"
+                return {
+                    "url": url,
+                    "checksum": wasm["checksum"]
+                }
+            # The matching release has no Wasm SDK; no later entry will either
+            break
     return None
 
+def find_release_sdk(version_id):
+    # version_id is like '6.2.3' or 'swift-6.2.3-RELEASE'
+    return lookup_api("https://www.swift.org/api/v1/install/releases.json", lambda text: match_release_sdk(text, version_id))
+
+def match_dev_snapshot(snapshots_text, version_id):
+    snapshots = json.loads(snapshots_text)
+    if not snapshots:
+        return None
+
+    # snap["dir"] is like 'swift-DEVELOPMENT-SNAPSHOT-2024-12-10-a'
+    # version_id is usually exactly that, but might be prefixed with swift-<version>-
+    dirs = {snap["dir"]: snap for snap in snapshots}
+    snap = dirs.get(version_id)
+    if snap is None:
+        snap = next((s for d, s in dirs.items() if d in version_id), None)
+    if snap is None:
+        return None
+
+    download_url = f"https://download.swift.org/development/wasm-sdk/{snap['dir']}/{snap['download']}"
+    return {
+        "url": download_url,
+        "checksum": snap["checksum"]
+    }
+
+def find_dev_sdk_in_branch(branch, version_id, errors):
+    url = f"https://www.swift.org/api/v1/install/dev/{branch}/wasm-sdk.json"
+    return lookup_api(url, lambda text: match_dev_snapshot(text, version_id), errors)
+
 def find_dev_sdk(version_id):
     # version_id is like 'swift-6.2-DEVELOPMENT-SNAPSHOT-2024-12-10-a'
     # We need to find the branch. Usually it's in the ID.
-    match = re.match(r"swift-([0-9.]+)-DEVELOPMENT", version_id)
+    match = _DEV_BRANCH_RE.match(version_id)
     branch = "main"
     if match:
         branch = f"swift-{match.group(1)}-branch"
@@ -77,29 +212,87 @@ def find_dev_sdk(version_id):
     branches_to_try = [branch, "main"]
     if "DEVELOPMENT" in version_id:
         # Check if it's a specific release branch like 6.2
-        m = re.match(r"swift-([0-9.]+)", version_id)
+        m = _VERSION_PREFIX_RE.match(version_id)
         if m:
             branches_to_try.insert(0, f"swift-{m.group(1)}-release")
+    # Drop duplicates (e.g. 'main' twice for trunk snapshots) while keeping the priority order
+    branches_to_try = list(dict.fromkeys(branches_to_try))
 
-    for b in branches_to_try:
-        url = f"https://www.swift.org/api/v1/install/dev/{b}/wasm-sdk.json"
-        snapshots = fetch_json(url)
-        if not snapshots:
-            continue
-        
-        for snap in snapshots:
-            # snap["dir"] is like 'swift-DEVELOPMENT-SNAPSHOT-2024-12-10-a'
-            # version_id might be exactly that or prefixed with swift-<version>-
-            if snap["dir"] in version_id or version_id in snap["dir"]:
-                download_url = f"https://download.swift.org/development/wasm-sdk/{snap['dir']}/{snap['download']}"
-                return {
-                    "url": download_url,
-                    "checksum": snap["checksum"]
-                }
+    # Fetch every candidate branch at once and take the first hit in priority
+    # order, without waiting on lower-priority probes once it is known.
+    # Missing branches are expected (not every version has a release branch),
+    # so fetch errors are only reported when no branch has the snapshot.
+    errors = [[] for _ in branches_to_try]
+    executor = ThreadPoolExecutor(max_workers=len(branches_to_try))
+    try:
+        futures = [executor.submit(find_dev_sdk_in_branch, b, version_id, e) for b, e in zip(branches_to_try, errors)]
+        for future in futures:
+            sdk_info = future.result()
+            if sdk_info:
+                return sdk_info
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    for branch_errors in errors:
+        for message in branch_errors:
+            print(message)
     return None
 
-def main():
-    version_id = get_swift_version()
+def download_with_checksum(url, expected_checksum):
+    # Bundles stay in the cache until they are installed, so a failed install or an
+    # interrupted download doesn't have to start over
+    sdks_dir = os.path.join(get_cache_dir(), "sdks")
+    path = os.path.join(sdks_dir, url.rsplit("/", 1)[-1])
+    part_path = path + ".part"
+
+    if os.path.exists(path):
+        hasher = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(_DOWNLOAD_CHUNK_SIZE), b""):
+                hasher.update(chunk)
+        if hasher.hexdigest() == expected_checksum:
+            print(f"Using cached SDK bundle: {path}")
+            return path
+        os.remove(path)
+
+    os.makedirs(sdks_dir, exist_ok=True)
+    hasher = hashlib.sha256()
+    offset = 0
+    if os.path.exists(part_path):
+        with open(part_path, "rb") as f:
+            for chunk in iter(lambda: f.read(_DOWNLOAD_CHUNK_SIZE), b""):
+                hasher.update(chunk)
+                offset += len(chunk)
+
+    if not offset or hasher.hexdigest() != expected_checksum:
+        print(f"Downloading {url}")
+        headers = {"Range": f"bytes={offset}-"} if offset else {}
+        try:
+            with urllib.request.urlopen(urllib.request.Request(url, headers=headers)) as response:
+                mode = "ab"
+                if response.status != 206:
+                    # The server ignored the range request; start over
+                    hasher = hashlib.sha256()
+                    mode = "wb"
+                with open(part_path, mode) as f:
+                    while chunk := response.read(_DOWNLOAD_CHUNK_SIZE):
+                        hasher.update(chunk)
+                        f.write(chunk)
+        except urllib.error.HTTPError as e:
+            if e.code == 416:
+                # The partial file is already as long as the bundle but doesn't match
+                os.remove(part_path)
+            raise
+
+    if hasher.hexdigest() != expected_checksum:
+        os.remove(part_path)
+        raise ValueError(f"checksum mismatch for {url} (expected {expected_checksum}, got {hasher.hexdigest()})")
+    os.replace(part_path, path)
+    return path
+
+def install(version_id=None, force=False):
+    if version_id is None:
+        version_id = get_swift_version()
     if not version_id:
         print("Could not determine Swift version from 'swiftc'")
         sys.exit(1)
@@ -113,16 +306,28 @@ def main():
 
     print(f"Detected Swift version ID: {version_id}")
 
+    # Skip the swift.org lookup entirely when the exact SDK bundle for this
+    # toolchain (e.g. 'swift-6.2.3-RELEASE_wasm.artifactbundle') is already installed
+    if not force:
+        installed = find_matching_sdk_bundle(get_installed_sdk_bundles(), version_id)
+        if installed:
+            print(f"Swift SDK for WebAssembly is already installed ({os.fsdecode(installed)}).")
+            print("Pass --force to run 'swift sdk install' anyway.")
+            return
+
     sdk_info = None
-    if "-RELEASE" in version_id or re.match(r"^[0-9.]+$", version_id):
+    tried_release = False
+    is_numeric = version_id.replace(".", "").isdigit()
+    if "-RELEASE" in version_id or is_numeric:
         sdk_info = find_release_sdk(version_id)
+        tried_release = True
     else:
         sdk_info = find_dev_sdk(version_id)
 
     if not sdk_info:
         print(f"Could not find a matching Wasm SDK for version {version_id}")
         # Try one last fallback: if it's a version number, try release search anyway
-        if not sdk_info and re.search(r"[0-9.]+", version_id):
+        if not tried_release and any(c.isdigit() for c in version_id):
             sdk_info = find_release_sdk(version_id)
             
     if sdk_info:
@@ -130,7 +335,19 @@ def main():
         print(f"  URL: {sdk_info['url']}")
         print(f"  Checksum: {sdk_info['checksum']}")
         
-        cmd = ["swift", "sdk", "install", sdk_info["url"], "--checksum", sdk_info["checksum"]]
+        bundle_path = None
+        try:
+            # The checksum has already been verified while downloading
+            bundle_path = download_with_checksum(sdk_info["url"], sdk_info["checksum"])
+            cmd = ["swift", "sdk", "install", bundle_path]
+        except ValueError as e:
+            # 'swift sdk install' would download the same bundle and fail the same check
+            print(f"Error verifying SDK: {e}")
+            sys.exit(1)
+        except (OSError, http.client.HTTPException) as e:
+            print(f"Error downloading SDK: {e}")
+            print("Falling back to letting 'swift sdk install' download it.")
+            cmd = ["swift", "sdk", "install", sdk_info["url"], "--checksum", sdk_info["checksum"]]
         print(f"Running: {' '.join(cmd)}")
         try:
             output = subprocess.check_output(cmd, stderr=subprocess.STDOUT).decode("utf-8")
@@ -144,10 +361,28 @@ def main():
             else:
                 print(f"Error installing SDK: {output}")
                 sys.exit(1)
+        if bundle_path:
+            # SwiftPM keeps its own copy of the installed bundle
+            try:
+                os.remove(bundle_path)
+            except OSError:
+                pass
     else:
         print("No matching SDK found. Please install manually from https://www.swift.org/download/")
         sys.exit(1)
 
+def main():
+    global _use_api_cache
+
+    parser = argparse.ArgumentParser(description="Install the Swift SDK for WebAssembly matching the current toolchain.")
+    parser.add_argument("--version-id", help="Toolchain tag to install the SDK for (e.g. swift-6.2.3-RELEASE); detected from 'swiftc' if omitted")
+    parser.add_argument("--no-cache", action="store_true", help="Ignore cached swift.org API responses")
+    parser.add_argument("--force", action="store_true", help="Run 'swift sdk install' even if a matching SDK bundle is already present")
+    args = parser.parse_args()
+    _use_api_cache = not args.no_cache
+
+    install(args.version_id, force=args.force)
+
 if __name__ == "__main__":
     main()
 